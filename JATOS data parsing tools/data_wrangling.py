@@ -20,105 +20,114 @@ parse_labjs_data
 """
 
 # import dependencies
+import errno
 import os
 import shutil
-import jsonlines
+import orjson
+from itertools import chain
 import pandas as pd
-from pathlib import Path
 
 
 
-def collect_data_files(data_dir):
+def collect_data_files(data_dir, verbose=False):
     """
     Rename data.txt files in study_result folders using participant ID and component number.
 
     Args:
         data_dir: (string) Root directory containing study_result folders
+        verbose: (logical) if True, list every renamed/moved file and removed folder once
+        the walk has finished. Default is False, which only prints warnings and the totals.
 
     Usage:
         data_wrangling.collect_data_files(data_dir)
     """
-    root_path = Path(data_dir)
+    # Create raw_data folder if it doesn't exist
+    raw_data_folder = os.path.join(data_dir, 'raw_data')
+    os.makedirs(raw_data_folder, exist_ok=True)
+
+    msgs = [f"Created/verified folder: {raw_data_folder}\n"]
+    files_moved = 0
+    folders_removed = 0
 
-    # Find all study_result folders
-    study_folders = sorted([d for d in root_path.iterdir() 
-                           if d.is_dir() and d.name.startswith('study_result_')])
+    # Find all study_result folders (the root is listed once)
+    with os.scandir(data_dir) as entries:
+        study_folders = sorted([e for e in entries
+                               if e.is_dir() and e.name.startswith('study_result_')], key=lambda e: e.name)
 
+    # Walk each study_result folder once: rename, move and clean up as we go.
+    # Every folder is listed exactly once; whether it is empty afterwards is
+    # worked out from that listing instead of reading the folder again.
     for study_folder in study_folders:
         # Extract participant ID from folder name
         participant_id = study_folder.name.split('_')[2]
 
         # Find all comp-result folders and sort them
-        comp_folders = sorted([d for d in study_folder.iterdir() 
-                              if d.is_dir() and d.name.startswith('comp-result_')])
+        with os.scandir(study_folder.path) as entries:
+            study_entries = list(entries)
+        comp_folders = sorted([e for e in study_entries
+                              if e.is_dir() and e.name.startswith('comp-result_')], key=lambda e: e.name)
+        comp_folders_removed = 0
 
-        # Rename data.txt files with component number (1-indexed)
         for component_num, comp_folder in enumerate(comp_folders, start=1):
-            data_file = comp_folder / 'data.txt'
-
-            if data_file.exists():
-                new_filename = f"{participant_id}_{component_num}.txt"
-                new_filepath = comp_folder / new_filename
-
-                # Rename the file
-                data_file.rename(new_filepath)
-                print(f"Renamed: {data_file} -> {new_filepath}")
+            with os.scandir(comp_folder.path) as entries:
+                comp_entries = list(entries)
+            txt_files = [e for e in comp_entries
+                         if e.is_file() and os.path.splitext(e.name)[1] == '.txt']
+
+            # Every entry goes if they are all .txt files (checked before the list is trimmed below)
+            moves_all_entries = len(txt_files) == len(comp_entries)
+
+            new_filename = f"{participant_id}_{component_num}.txt"
+            if any(file.name == 'data.txt' for file in txt_files):
+                # Renaming data.txt overwrites any existing file with the new name
+                # (e.g. from a re-export), so that file is no longer there to move
+                txt_files = [file for file in txt_files if file.name != new_filename]
             else:
-                print(f"Warning: {data_file} not found")
-                
-                
-
-    # Create raw_data folder if it doesn't exist
-    raw_data_folder = root_path / 'raw_data'
-    raw_data_folder.mkdir(exist_ok=True)
-    print(f"Created/verified folder: {raw_data_folder}\n")
-
-    # Find all study_result folders
-    study_folders = sorted([d for d in root_path.iterdir() 
-                           if d.is_dir() and d.name.startswith('study_result_')])
-
-    files_moved = 0
-
-    for study_folder in study_folders:
-        # Find all comp-result folders
-        comp_folders = sorted([d for d in study_folder.iterdir() 
-                              if d.is_dir() and d.name.startswith('comp-result_')])
-
-        for comp_folder in comp_folders:
-            # Look for renamed files (format: XXXX_Y.txt)
-            for file in comp_folder.iterdir():
-                if file.is_file() and file.suffix == '.txt':
-                    # Move file to raw_data folder
-                    destination = raw_data_folder / file.name
-                    shutil.move(str(file), str(destination))
-                    print(f"Moved: {file} -> {destination}")
-                    files_moved += 1
-
-    print(f"\nTotal files moved: {files_moved}\n")
-
-    # Remove empty folders
-    print("Removing empty folders...")
-    folders_removed = 0
-
-    for study_folder in study_folders:
-        # Find all comp-result folders
-        comp_folders = sorted([d for d in study_folder.iterdir() 
-                              if d.is_dir() and d.name.startswith('comp-result_')])
-
-        # Remove empty comp-result folders
-        for comp_folder in comp_folders:
-            if comp_folder.exists() and not any(comp_folder.iterdir()):
-                comp_folder.rmdir()
-                print(f"Removed: {comp_folder}")
+                print(f"Warning: {os.path.join(comp_folder.path, 'data.txt')} not found")
+
+            for file in txt_files:
+                file_path = file.path
+
+                # Rename data.txt with component number (1-indexed)
+                if file.name == 'data.txt':
+                    new_filepath = os.path.join(comp_folder.path, new_filename)
+                    os.rename(file_path, new_filepath)
+                    if verbose:
+                        msgs.append(f"Renamed: {file_path} -> {new_filepath}")
+                    file_path = new_filepath
+
+                # Move file to raw_data folder (a plain rename, unless it is on another filesystem)
+                destination = os.path.join(raw_data_folder, os.path.basename(file_path))
+                try:
+                    os.replace(file_path, destination)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(file_path, destination)
+                if verbose:
+                    msgs.append(f"Moved: {file_path} -> {destination}")
+                files_moved += 1
+
+            # Remove comp-result folder if everything in it has been moved
+            if moves_all_entries:
+                os.rmdir(comp_folder.path)
+                if verbose:
+                    msgs.append(f"Removed: {comp_folder.path}")
                 folders_removed += 1
+                comp_folders_removed += 1
 
-        # Remove empty study_result folder
-        if study_folder.exists() and not any(study_folder.iterdir()):
-            study_folder.rmdir()
-            print(f"Removed: {study_folder}")
+        # Remove study_result folder if all its entries were removed comp-result folders
+        if comp_folders_removed == len(study_entries):
+            os.rmdir(study_folder.path)
+            if verbose:
+                msgs.append(f"Removed: {study_folder.path}")
             folders_removed += 1
 
-    print(f"\nTotal folders removed: {folders_removed}")
+    if verbose:
+        print('\n'.join(msgs))
+
+    print(f"\nTotal files moved: {files_moved}")
+    print(f"Total folders removed: {folders_removed}")
 
 
 
@@ -132,6 +141,9 @@ def parse_labjs_data(raw, remove_meta_data = True):
         remove_meta_data: (logical) if True, remove the first line of the dataframe, which contains 
         meta-data such as labjs version number, participant's device operating system, etc.
         Default is True.
+
+    Note: numeric columns with missing values (e.g. "rt", which the meta-data row
+    lacks) come back as float64 with NaN, not as object columns with None.
     
     Usage:
         df = data_wrangling.parse_labjs_data(raw, True)
@@ -140,23 +152,17 @@ def parse_labjs_data(raw, remove_meta_data = True):
 
 
 
-    with open(raw, 'r') as f:
-        first_line = f.readline()
-        if '"labjs_version"' not in first_line:
+    with open(raw, 'rb', buffering=131072) as f:                   # open the file once; the lab.js data is stored in "JSON" format, one JSON value per line
+        first_line = f.readline()                                  # read the first line to check the format
+        if b'"labjs_version"' not in first_line:
             print('This file does not appear to be in lab.js format')
             return None
-
-    i = 0                                                          # set counter variable "i" to zero
-
-    with jsonlines.open(raw) as reader:                            # make a "reader" variable with the lab.js data (which is stored in "JSON" format)
-        for line in reader:                                        # loop through every line in the lab.js JSON data
-            if i == 0:                                             # check if i equals zero. If it does, then
-                df = pd.DataFrame(line)                            # make a new pandas dataframe called "df" 
-                i += 1                                             # add 1 to i
-            else:                                                  # if i does not equal zero 
-                df = pd.concat([df, pd.DataFrame(line)], ignore_index=True)           # get the next line of the json file, convert it to a dataframe, and stick it on the bottom of "df"                                           # add 1 to i
-        print('labjs data found and imported 👍')
-        return(df.drop(index=0) if remove_meta_data else df)          # after looping through all lines, return the dataframe "df", but drop the first line (index 0) if remove_meta_data is True. Otherwise, return the full dataframe with meta-data included.
+        lines = [orjson.loads(first_line)]                         # decode the first line we already read...
+        lines += [orjson.loads(line) for line in f if line.strip()] # ...and every remaining non-empty line with orjson
+    rows = list(chain.from_iterable(lines))                        # each line is a list of trial dicts, so flatten all lines into one list of rows
+    df = pd.DataFrame(rows)                                        # build the dataframe "df" in one go, rather than growing it line by line
+    print('labjs data found and imported 👍')
+    return(df.drop(index=0) if remove_meta_data else df)          # return the dataframe "df", but drop the first line (index 0) if remove_meta_data is True. Otherwise, return the full dataframe with meta-data included.
 
 
 
@@ -167,21 +173,14 @@ def parse_jatos_data(raw):
 
     Args: 
         raw: (string) Path to text file with data
-        
+
+    Note: numeric columns with missing values come back as float64 with NaN
+    (e.g. [1, None, 3] becomes [1.0, NaN, 3.0]), not as object columns with None.
     
     Usage:
         df = data_wrangling.parse_jatos_data(raw)
     """
 
 
-    i = 0                                                          # set counter variable "i" to zero
-
-    with jsonlines.open(raw) as reader:                            # make a "reader" variable with the lab.js data (which is stored in "JSON" format)
-        for line in reader:                                        # loop through every line in the lab.js JSON data
-            if i == 0:                                             # check if i equals zero. If it does, then
-                df = pd.DataFrame([line])                            # make a new pandas dataframe called "df" 
-                i += 1                                             # add 1 to i
-            else:                                                  # if i does not equal zero 
-                df = pd.concat([df, pd.DataFrame([line])], ignore_index=True)           # get the next line of the json file, convert it to a dataframe, and stick it on the bottom of "df" 
-    return df
-
+    return pd.read_json(raw, lines=True, precise_float=True,       # the data is stored one JSON object per line, which pandas can read directly into a dataframe
+                        dtype=False, convert_dates=False)          # don't turn columns into dates or guess dtypes from the values
@@ -12,12 +12,18 @@ LINE_HEIGHT          = 25
 HORIZONTAL_PADDING   = 30
 VERTICAL_PADDING_TOP = 20
 
+import functools
+import itertools
+import mmap
+import multiprocessing
 import pathlib
-import jsonlines
+import orjson
+import numpy as np
 import pandas as pd
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from PIL import ImageFont
 from matplotlib import pyplot as plt
+from matplotlib.collections import PatchCollection
 from matplotlib.colors import LinearSegmentedColormap
 
 
@@ -125,7 +131,7 @@ def build_dataframe(data, data_dir):
 
     frames = []
     for trial in data:
-        wdf = trial['word_durations'].copy()
+        wdf = word_durations_to_dataframe(trial['word_durations'])
         wdf['participant_id'] = trial['participant_id']
         wdf['trial_num']      = trial['trial_num']
         wdf['text_content']   = trial['text_content']
@@ -158,61 +164,121 @@ def get_mouse_data(df_reading, trial_num=0):
     return mouse_tracking
 
 
+def get_mouse_arrays(mouse_data):
+    """
+    Convert a list of mouse samples ({'x', 'y', 'timestamp'} dicts) into three
+    parallel float64 arrays: xs, ys, ts. float64 is needed for the timestamps,
+    which are epoch milliseconds.
+    """
+    n = len(mouse_data)
+    xs = np.fromiter((p['x'] for p in mouse_data), np.float64, count=n)
+    ys = np.fromiter((p['y'] for p in mouse_data), np.float64, count=n)
+    ts = np.fromiter((p['timestamp'] for p in mouse_data), np.float64, count=n)
+    return xs, ys, ts
+
+
 def get_canvas_dimensions(df_reading, trial_num=0):
     trial = df_reading.iloc[trial_num]
     return trial['canvas_width'], trial['canvas_height']
 
-def load_font(size=18):
-    """Load a TrueType font, falling back to default if necessary."""
-    font_paths = [
-        'arial.ttf',
-        'C:/Windows/Fonts/arial.ttf',
-        '/usr/share/fonts/truetype/msttcorefonts/Arial.ttf',
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-        '/System/Library/Fonts/Helvetica.ttc',
-        '/Library/Fonts/Arial.ttf',
-    ]
-    for path in font_paths:
+FONT_PATHS = [
+    'arial.ttf',
+    'C:/Windows/Fonts/arial.ttf',
+    '/usr/share/fonts/truetype/msttcorefonts/Arial.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/System/Library/Fonts/Helvetica.ttc',
+    '/Library/Fonts/Arial.ttf',
+]
+
+
+def _discover_font_path():
+    """Return the first TrueType font in FONT_PATHS that can be opened, or None."""
+    for path in FONT_PATHS:
         try:
-            return ImageFont.truetype(path, size)
+            ImageFont.truetype(path)
+            return path
         except (IOError, OSError):
             continue
+    return None
+
+
+# Probed once at import, so load_font() does not retry missing paths on every call
+_FONT_PATH = _discover_font_path()
+
+
+def load_font(size=18, path=None):
+    """
+    Load a TrueType font, falling back to default if necessary. path defaults
+    to the font found in FONT_PATHS. Fonts are cached by (size, path), so
+    repeated calls return the same font object however they are spelled.
+    """
+    return _load_font(size, path or _FONT_PATH)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_font(size, path):
+    """Cached body of load_font(), called with normalized arguments."""
+    if path is not None:
+        return ImageFont.truetype(path, size)
     print("Warning: Using default font. Text positioning may be less accurate.")
     return ImageFont.load_default()
 
 
+# Rendered word widths, keyed by (font object, word). Texts in a study share most
+# of their vocabulary, so most lookups skip FreeType entirely. Fonts come from the
+# cached load_font(), so one object stands for one exact face, size and layout.
+_WORD_WIDTH_CACHE = {}
+
+
+def _word_width(font, word):
+    """Return the rendered width of word in font, using _WORD_WIDTH_CACHE."""
+    key = (font, word)
+    width = _WORD_WIDTH_CACHE.get(key)
+    if width is None:
+        bbox = font.getbbox(word)
+        width = _WORD_WIDTH_CACHE[key] = bbox[2] - bbox[0]
+    return width
+
+
+@functools.lru_cache(maxsize=512)
 def get_word_positions(text, canvas_width, font,
                        horizontal_padding=HORIZONTAL_PADDING,
                        vertical_padding_top=VERTICAL_PADDING_TOP,
                        line_height=LINE_HEIGHT):
 
-    """Calculate pixel positions for each word in the text."""
+    """
+    Calculate pixel positions for each word in the text.
+
+    Results are memoized on the arguments, since the same stimulus text is
+    laid out once per participant. The returned list is shared between calls
+    and must be treated as read-only.
+    """
     text_start_x = horizontal_padding // 2
     text_start_y = vertical_padding_top + 10
     available_width = canvas_width - horizontal_padding
     words = text.split(' ')
     word_positions = []
-    current_line_text = ''
     current_x = text_start_x
     line_index = 0
 
-    for word in words:
-        test_line = current_line_text + (' ' if current_line_text else '') + word
-        bbox = font.getbbox(test_line)
-        test_width = bbox[2] - bbox[0]
+    # Measure every word (and the space between words) once, then break
+    # lines by adding up widths instead of re-measuring the growing line
+    space_width = _word_width(font, ' ')
+    word_widths = [_word_width(font, word) for word in words]
 
-        if test_width > available_width and current_line_text:
+    line_width = 0
+    for word, word_width in zip(words, word_widths):
+        test_width = line_width + space_width + word_width if line_width else word_width
+
+        if test_width > available_width and line_width:
             line_index += 1
-            current_line_text = word
+            line_width = word_width
             current_x = text_start_x
         else:
-            if current_line_text:
-                prev_bbox = font.getbbox(current_line_text + ' ')
-                current_x = text_start_x + (prev_bbox[2] - prev_bbox[0])
-            current_line_text = test_line
+            if line_width:
+                current_x = text_start_x + line_width + space_width
+            line_width = test_width
 
-        word_bbox = font.getbbox(word)
-        word_width = word_bbox[2] - word_bbox[0]
         y_position = text_start_y + (line_index * LINE_HEIGHT)
 
         word_positions.append({
@@ -231,10 +297,55 @@ def get_text_content(df_reading, trial_num=0):
     return df_reading.iloc[trial_num]['text_content']
 
 
-def compute_word_durations(df_reading, canvas_width=None, text=None, word_positions=None, trial_num=0, x_tolerance=5, y_tolerance=15):
+def _find_words(xs, ys, word_positions, x_tolerance, y_tolerance):
+    """
+    Return, for each sample, the index of the first word (in reading order)
+    whose box contains it, or -1 if it is not on any word.
+
+    word_positions is in reading order, so each line is a contiguous run of
+    words with ascending x. Samples are bucketed onto lines by binary search
+    on y, then onto a word by binary search on x within the line.
+    """
+    x_start = np.array([wp['x_start'] for wp in word_positions], dtype=float)
+    x_end   = np.array([wp['x_end'] for wp in word_positions], dtype=float)
+    y_pos   = np.array([wp['y_position'] for wp in word_positions], dtype=float)
+    line_idx = np.array([wp['line_index'] for wp in word_positions])
+    line_bounds = np.concatenate(([0], np.flatnonzero(np.diff(line_idx)) + 1, [len(word_positions)]))
+
+    hit_word_idx = np.full(len(xs), -1)
+    order = np.argsort(ys, kind='stable')
+    ys_sorted = ys[order]
+
+    # Lines are visited top to bottom, so where the y tolerances of two lines
+    # overlap, a sample is credited to the upper line if it is on a word there
+    for lo, hi in zip(line_bounds[:-1], line_bounds[1:]):
+        line_y = y_pos[lo]
+        first = np.searchsorted(ys_sorted, line_y - y_tolerance, side='left')
+        last = np.searchsorted(ys_sorted, line_y + y_tolerance, side='right')
+        samples = order[first:last]
+        samples = samples[hit_word_idx[samples] < 0]
+        if len(samples) == 0:
+            continue
+
+        # First word on the line whose right edge (plus tolerance) reaches x
+        x = xs[samples]
+        i = np.searchsorted(x_end[lo:hi] + x_tolerance, x, side='left')
+        on_word = i < hi - lo
+        on_word[on_word] = x[on_word] >= x_start[lo:hi][i[on_word]] - x_tolerance
+        hit_word_idx[samples[on_word]] = lo + i[on_word]
+
+    return hit_word_idx
+
+
+def compute_word_durations(df_reading, canvas_width=None, text=None, word_positions=None, trial_num=0, x_tolerance=5, y_tolerance=15,
+                           mouse_arrays=None):
     """
     Compute duration spent on each word from mouse tracking data.
-    Returns a DataFrame with word positions and durations.
+    Returns a dict of parallel arrays with word positions and durations
+    (see word_durations_to_dataframe() to get a DataFrame).
+
+    mouse_arrays can be the (xs, ys, ts) tuple from get_mouse_arrays() for this
+    trial; if omitted, the samples are read from df_reading.
     """
     
     if canvas_width is None:
@@ -244,54 +355,114 @@ def compute_word_durations(df_reading, canvas_width=None, text=None, word_positi
     if word_positions is None:
         raise ValueError("word_positions must be provided.")
 
-    tracking = get_mouse_data(df_reading, trial_num=trial_num)
+    if mouse_arrays is None:
+        mouse_arrays = get_mouse_arrays(get_mouse_data(df_reading, trial_num=trial_num))
+    xs, ys, ts = mouse_arrays
     word_positions = word_positions
-    word_durations = {i: 0.0 for i in range(len(word_positions))}
+    word_durations = np.zeros(len(word_positions))
 
-    n = len(tracking)
+    n = len(ts)
     if n < 2:
-        return pd.DataFrame([{
-            'word_number': wp['word_index'],
-            'word': wp['word'],
-            'duration_ms': 0.0,
-            'x_start': wp['x_start'],
-            'x_end': wp['x_end'],
-            'y_position': wp['y_position'],
-            'line_number': wp['line_index']
-        } for wp in word_positions])
-
-    for i in range(n - 1):
-        point = tracking[i]
-        next_point = tracking[i + 1]
-
-        x, y = point['x'], point['y']
-        dt = next_point['timestamp'] - point['timestamp']
-
-        if dt <= 0 or dt > 1000:
-            continue
+        return _word_durations_dict(word_positions, word_durations)
+
+    # Each sample i is credited with the time until sample i + 1. Drop samples
+    # with a gap that is out of order or over a second before looking up words
+    dts = np.diff(ts)
+    valid = (dts > 0) & (dts <= 1000)
+    xs, ys, dts = xs[:-1][valid], ys[:-1][valid], dts[valid]
+
+    hit_word_idx = _find_words(xs, ys, word_positions, x_tolerance, y_tolerance)
+    has_hit = hit_word_idx >= 0
+    np.add.at(word_durations, hit_word_idx[has_hit], dts[has_hit])
+
+    return _word_durations_dict(word_positions, word_durations)
+
 
-        for wp in word_positions:
-            if (wp['x_start'] - x_tolerance) <= x <= (wp['x_end'] + x_tolerance):
-                if (wp['y_position'] - y_tolerance) <= y <= (wp['y_position'] + y_tolerance):
-                    word_durations[wp['word_index']] += dt
-                    break
+def _word_durations_dict(word_positions, durations):
+    """Pack word positions and per-word durations into a dict of parallel arrays."""
+    return {
+        'word_number': np.arange(len(word_positions)),
+        'word':        np.array([wp['word'] for wp in word_positions], dtype=object),
+        'duration_ms': np.round(durations, 2),
+        'x_start':     np.round([wp['x_start'] for wp in word_positions], 1),
+        'x_end':       np.round([wp['x_end'] for wp in word_positions], 1),
+        'y_position':  np.round([wp['y_position'] for wp in word_positions], 1),
+        'line_number': np.array([wp['line_index'] for wp in word_positions]),
+    }
+
+
+def word_durations_to_dataframe(word_durations):
+    """Convert the output of compute_word_durations() to a DataFrame, one row per word."""
+    return pd.DataFrame(word_durations)
+
+
+def _read_json_lines(raw):
+    """
+    Decode every non-empty line of a raw JATOS .txt file. The file is
+    memory-mapped rather than read through a Python file buffer.
+    """
+    with open(raw, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [orjson.loads(line) for line in iter(mm.readline, b'') if line.strip()]
+
+
+def _process_one(raw, font):
+    """Build the trial dicts for a single raw JATOS .txt file."""
+    lines = _read_json_lines(raw)
+
+    # Format 1: single line containing a list of trial dicts (e.g. 6138_2.txt)
+    if len(lines) == 1 and isinstance(lines[0], list):
+        df = pd.DataFrame(lines[0])
+
+    # Format 2: one trial dict per line (e.g. 6138_3.txt)
+    else:
+        df = pd.DataFrame(lines)
+
+
+    participant_id = get_participant_id(raw)
+    reading_trials = get_reading_trials(df)
 
     data = []
-    for wp in word_positions:
+
+    for trial in range(len(reading_trials)):
+        canvas_width, canvas_height = get_canvas_dimensions(reading_trials, trial_num=trial)
+        text_content               = get_text_content(reading_trials, trial_num=trial)
+        mouse_data                 = get_mouse_data(reading_trials, trial_num=trial)
+        mouse_xs, mouse_ys, mouse_ts = get_mouse_arrays(mouse_data)
+        word_positions             = get_word_positions(text_content, canvas_width, font)
+        word_durations            = compute_word_durations(reading_trials, canvas_width, text_content,
+                                    word_positions, trial_num=trial,
+                                    mouse_arrays=(mouse_xs, mouse_ys, mouse_ts))
+
+
         data.append({
-            'word_number': wp['word_index'],
-            'word': wp['word'],
-            'duration_ms': round(word_durations[wp['word_index']], 2),
-            'x_start': round(wp['x_start'], 1),
-            'x_end': round(wp['x_end'], 1),
-            'y_position': round(wp['y_position'], 1),
-            'line_number': wp['line_index']
+            'participant_id': participant_id,
+            'trial_num':      trial,
+            'text_content':   text_content,
+            'mouse_xs':       mouse_xs,
+            'mouse_ys':       mouse_ys,
+            'mouse_ts':       mouse_ts,
+            'canvas_width':   canvas_width,
+            'canvas_height':  canvas_height,
+            'word_positions': word_positions,
+            'word_durations': word_durations,
         })
 
-    return pd.DataFrame(data)
+    return data
+
+
+def _process_one_in_worker(raw, font_path, font_size):
+    """
+    Worker-process entry point for build_data(). The font is passed as a path
+    and size rather than an object, so each worker loads it once through the
+    cached load_font() and get_word_positions() keeps hitting its cache.
+    """
+    return _process_one(raw, load_font(font_size, font_path))
 
 
-def build_data(raw_files, font=None):
+def build_data(raw_files, font=None, processes=1):
     """
     Builds the data list from a list of raw JATOS .txt file paths.
 
@@ -300,56 +471,39 @@ def build_data(raw_files, font=None):
             List of file paths to raw JATOS .txt data files.
 
     font : PIL ImageFont
-        Font object used for computing word positions.
+        Font object used for computing word positions. Default is load_font().
+
+    processes : int
+        Number of worker processes. Default is 1, which processes the files in
+        the current process. Use None for one worker per CPU, or any other
+        number to process files in parallel, one file per task; font must then
+        be a TrueType font loaded from a file (or None). On macOS and Windows
+        the calling script must guard the call with
+        `if __name__ == '__main__':`, or the workers cannot start.
 
     Returns
     -------
     list of dict
-        One dictionary per trial, across all participants and files.
+        One dictionary per trial, across all participants and files,
+        in the order of raw_files.
     """
 
-    if font is None:
-        font = load_font()  # uses load_font() function from this module
-
-    data = []
-
-    for raw in raw_files:
-        with jsonlines.open(raw) as reader:
-            lines = [line for line in reader]
-
-        # Format 1: single line containing a list of trial dicts (e.g. 6138_2.txt)
-        if len(lines) == 1 and isinstance(lines[0], list):
-            df = pd.DataFrame(lines[0])
-
-        # Format 2: one trial dict per line (e.g. 6138_3.txt)
-        else:
-            df = pd.DataFrame(lines)
-
-
-        participant_id = get_participant_id(raw)
-        reading_trials = get_reading_trials(df)
-
-        for trial in range(len(reading_trials)):
-            canvas_width, canvas_height = get_canvas_dimensions(reading_trials, trial_num=trial)
-            text_content               = get_text_content(reading_trials, trial_num=trial)
-            mouse_data                 = get_mouse_data(reading_trials, trial_num=trial)
-            word_positions             = get_word_positions(text_content, canvas_width, font)
-            word_durations            = compute_word_durations(reading_trials, canvas_width, text_content,
-                                        word_positions, trial_num=trial)
-
+    if processes == 1:
+        if font is None:
+            font = load_font()  # uses load_font() function from this module
+        return [trial for raw in raw_files for trial in _process_one(raw, font)]
 
-            data.append({
-                'participant_id': participant_id,
-                'trial_num':      trial,
-                'text_content':   text_content,
-                'mouse_data':     mouse_data,
-                'canvas_width':   canvas_width,
-                'canvas_height':  canvas_height,
-                'word_positions': word_positions,
-                'word_durations': word_durations,
-            })
+    if font is None:
+        font_path, font_size = None, FONT_SIZE
+    elif isinstance(getattr(font, 'path', None), str):
+        font_path, font_size = font.path, font.size
+    else:
+        raise ValueError("font must be a TrueType font loaded from a file when processes != 1.")
 
-    return data
+    worker = functools.partial(_process_one_in_worker, font_path=font_path, font_size=font_size)
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.imap(worker, raw_files)
+        return list(itertools.chain.from_iterable(results))
 
 
 def plot_text_heatmap(participant, title=None, figsize=(14, 6)):
@@ -357,7 +511,7 @@ def plot_text_heatmap(participant, title=None, figsize=(14, 6)):
     Visual heatmap showing the text with words colored by duration.
     Reads directly from a participant dictionary in the `data` list.
     """
-    df           = participant['word_durations']
+    wd            = participant['word_durations']
     canvas_width  = participant['canvas_width']
     canvas_height = participant['canvas_height']
 
@@ -373,7 +527,7 @@ def plot_text_heatmap(participant, title=None, figsize=(14, 6)):
     ax.set_ylim(canvas_height, 0)
 
     # Calculate the actual extent of the text
-    #max_y = df['y_position'].max() + 30  # add a small bottom margin
+    #max_y = wd['y_position'].max() + 30  # add a small bottom margin
 
     #ax.set_xlim(0, canvas_width)
     #ax.set_ylim(max_y, 0)  # use text extent instead of canvas_height
@@ -383,27 +537,21 @@ def plot_text_heatmap(participant, title=None, figsize=(14, 6)):
     colors_cmap = ['#ffffff', '#fff3e0', '#ffcc80', '#ff9800', '#f44336', '#b71c1c']
     cmap = LinearSegmentedColormap.from_list('duration', colors_cmap)
 
-    max_dur = df['duration_ms'].max()
-    min_dur = df['duration_ms'].min()
+    max_dur = wd['duration_ms'].max()
+    min_dur = wd['duration_ms'].min()
     dur_range = max_dur - min_dur if max_dur != min_dur else 1
 
-    for _, row in df.iterrows():
-        norm_dur = (row['duration_ms'] - min_dur) / dur_range
-        color = cmap(norm_dur)
-
-        rect = plt.Rectangle(
-            (row['x_start'], row['y_position'] - 20),
-            row['x_end'] - row['x_start'],
-            24,
-            color=color,
-            zorder=1
-        )
-        ax.add_patch(rect)
+    # All word boxes go into one PatchCollection, drawn in a single call
+    colors = cmap((wd['duration_ms'] - min_dur) / dur_range)
+    rects = [plt.Rectangle((x_start, y_position - 20), x_end - x_start, 24)
+             for x_start, x_end, y_position in zip(wd['x_start'], wd['x_end'], wd['y_position'])]
+    ax.add_collection(PatchCollection(rects, facecolors=colors, edgecolors=colors, zorder=1))
 
+    for word, x_start, x_end, y_position in zip(wd['word'], wd['x_start'], wd['x_end'], wd['y_position']):
         ax.text(
-            (row['x_start'] + row['x_end']) / 2,
-            row['y_position'],
-            row['word'],
+            (x_start + x_end) / 2,
+            y_position,
+            word,
             ha='center', va='center',
             fontsize=9, zorder=2
         )